@@ -110,6 +110,51 @@ get_jobs() {
     dwqc ${DWQ_ENV} './.murdock get_jobs'
 }
 
+# drop the jobs not affected by the changes of a PR, using the dependency
+# index built from previous full runs (opt-in with CI_PRUNE_JOBS=1)
+prune_jobs() {
+    local repo_dir="$1"
+
+    if [ "${CI_PRUNE_JOBS}" = "1" ] && [ -n "${CI_DEPINDEX_FILE}" ] && \
+       [ -n "${CI_MERGE_COMMIT}" ] && [ "${NIGHTLY}" != "1" ] && \
+       [ "${FULL_BUILD}" != "1" ]; then
+        local jobs="$(mktemp)"
+        local kept_jobs="$(mktemp)"
+        cat > "${jobs}"
+
+        echo "--- pruning jobs not affected by ${CI_BASE_COMMIT}..${CI_MERGE_COMMIT}" >&2
+        if ${BASEDIR}/depindex.py "${CI_DEPINDEX_FILE}" prune \
+            "${repo_dir}" "${CI_BASE_COMMIT}" "${CI_MERGE_COMMIT}" \
+            < "${jobs}" > "${kept_jobs}"; then
+            cat "${kept_jobs}"
+        else
+            echo "--- pruning failed, not pruning any job" >&2
+            cat "${jobs}"
+        fi
+
+        rm -f "${jobs}" "${kept_jobs}"
+    else
+        cat
+    fi
+}
+
+# update the dependency index from the results of a nightly or base branch
+# build, merge queue builds may never land so they are not used
+update_depindex() {
+    if [ -z "${CI_DEPINDEX_FILE}" ] || [ -z "${CI_BUILD_COMMIT}" ] || \
+       [ -z "${CI_BUILD_BRANCH}" ] || is_merge_queue_build; then
+        return
+    fi
+
+    local full=""
+    if [ "${NIGHTLY}" = "1" ] && [ -z "${APPS}" ] && [ -z "${BOARDS}" ]; then
+        full="--full"
+    fi
+
+    echo "-- updating dependency index"
+    ${BASEDIR}/depindex.py "${CI_DEPINDEX_FILE}" update ${full} "${CI_BUILD_COMMIT}" || true
+}
+
 checkout_commit() {
     local repo_dir="$1"
     local base_repo="$2"
@@ -160,6 +205,8 @@ create_merge_commit() {
 : ${STATIC_TESTS:=0}
 : ${APPS:=}
 : ${BOARDS:=}
+: ${CI_PRUNE_JOBS:=0}
+: ${CI_DEPINDEX_FILE:=}
 
 set_status() {
     local status="{\"status\" : {\"status\": \"${1}\"}}"
@@ -265,7 +312,7 @@ main() {
     ${BASEDIR}/reporter.py -- "${report_queue}" "${CI_JOB_UID}" "${CI_JOB_TOKEN}" &
     local reporter_pid=$!
 
-    get_jobs | dwqc ${DWQ_ENV} \
+    get_jobs | prune_jobs ${repo_dir} | dwqc ${DWQ_ENV} \
         --maxfail ${DWQ_MAXFAIL} \
         --quiet --report ${report_queue} --outfile result.json
 
@@ -292,6 +339,8 @@ main() {
     # run post-build.d scripts
     post_build
 
+    update_depindex
+
     if [ -n "${CI_WORKER_BRANCH}" ]; then
         echo "-- cleaning up worker branch"
         git -C ${repo_dir} push --delete cache_repo ${CI_WORKER_BRANCH}
@@ -4,6 +4,11 @@ import os
 import re
 
 
+JOB_COMMAND_REGEX = re.compile(
+    r"./.murdock ([a-z_]+) ([a-zA-Z0-9/\-_]+) ([a-zA-Z0-9_\-]+):([a-z]+)"
+)
+
+
 def nicetime(seconds):
     seconds = abs(int(seconds))
     days, seconds = divmod(seconds, 86400)
@@ -28,10 +33,7 @@ def parse_job(job):
     result["name"] = os.path.join(
         *job["result"]["body"]["command"].split()[1:]
     )
-    match = re.match(
-        r"./.murdock ([a-z_]+) ([a-zA-Z0-9/\-_]+) ([a-zA-Z0-9_\-]+):([a-z]+)",
-        job["result"]["body"]["command"]
-    )
+    match = JOB_COMMAND_REGEX.match(job["result"]["body"]["command"])
     if match is not None:
         result["type"] = "tests" if match.group(1) == "run_test" else "builds"
         result["application"] = match.group(2)
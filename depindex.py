@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""Change-impact job pruning based on a dependency index.
+
+The index maps RIOT source directories to the (application, board) pairs whose
+build depends on them. It is updated from the results of full builds and used
+to drop PR jobs that cannot be affected by the changed files.
+"""
+
+import argparse
+import fcntl
+import os
+import subprocess
+import sys
+import tempfile
+
+import orjson
+
+from common import JOB_COMMAND_REGEX, parse_job
+
+
+RESULT_JSON_FILE = "result.json"
+PRUNED_JOBS_FILE = "pruned_jobs.txt"
+INDEX_VERSION = 2
+DEPDIRS_MARKER = "DEPDIRS:"
+
+
+def load_index(filename):
+    """Return the (pairs, commits, dirs) of the index, or None if it is unusable.
+
+    pairs is a list of [pair, commit id], the commit id indexing commits, the
+    commits the pairs were built from. dirs maps directories to pair ids.
+    """
+    try:
+        with open(filename, "rb") as f:
+            index = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+    try:
+        if index["version"] != INDEX_VERSION:
+            return None
+        pairs = index["pairs"]
+        commits = index["commits"]
+        dirs = index["dirs"]
+    except (TypeError, KeyError, IndexError):
+        return None
+
+    if not isinstance(pairs, list) or not isinstance(commits, list) or \
+            not isinstance(dirs, dict):
+        return None
+
+    return pairs, commits, dirs
+
+
+def load_entries(index):
+    """Return the index as a dict mapping pairs to (commit, set of dirs)."""
+    pairs, commits, dirs = index
+    names = [name for name, _ in pairs]
+    entries = {name: (commits[commit_id], set()) for name, commit_id in pairs}
+    for depdir, pair_ids in dirs.items():
+        for n in pair_ids:
+            entries[names[n]][1].add(depdir)
+    return entries
+
+
+def save_index(filename, entries):
+    names = sorted(entries)
+    commits = sorted({commit for commit, _ in entries.values()})
+    commit_ids = {commit: n for n, commit in enumerate(commits)}
+    pairs = []
+    dirs = {}
+    for n, name in enumerate(names):
+        commit, depdirs = entries[name]
+        pairs.append([name, commit_ids[commit]])
+        for depdir in depdirs:
+            dirs.setdefault(depdir, []).append(n)
+
+    index = {
+        "version": INDEX_VERSION,
+        "commits": commits,
+        "pairs": pairs,
+        "dirs": dirs,
+    }
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(index))
+        os.replace(tmpfile, filename)
+    except BaseException:
+        os.unlink(tmpfile)
+        raise
+
+
+def normalize_dir(depdir):
+    depdir = os.path.normpath(depdir)
+    if os.path.isabs(depdir) or depdir == "." or depdir.startswith(".."):
+        return None
+    return depdir
+
+
+def extract_depdirs(output):
+    """Collect the source directories reported by a compile job.
+
+    Jobs report them with lines of the form "DEPDIRS: dir1 dir2 ...", with
+    directories relative to the RIOT root. Returns None if nothing was
+    reported, as the dependencies of the job are then unknown.
+    """
+    depdirs = None
+    for line in output.split("\n"):
+        if not line.startswith(DEPDIRS_MARKER):
+            continue
+        if depdirs is None:
+            depdirs = set()
+        for depdir in line[len(DEPDIRS_MARKER):].split():
+            depdir = normalize_dir(depdir)
+            if depdir is not None:
+                depdirs.add(depdir)
+
+    return depdirs
+
+
+def update(args):
+    if not os.path.exists(RESULT_JSON_FILE):
+        print(f"No {RESULT_JSON_FILE} file found, not updating the index")
+        sys.exit(1)
+
+    with open(RESULT_JSON_FILE) as f:
+        results = orjson.loads(f.read())
+
+    # concurrent builds update the same index, serialize load, merge and save
+    with open(f"{args.index}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        updated, total = update_index(args.index, args.commit, results, args.full)
+
+    print(
+        f"--- dependency index: updated {updated} of {total} "
+        f"application/board pair(s)"
+    )
+
+
+def update_index(filename, commit, results, full):
+    entries = {}
+    index = load_index(filename)
+    # a full run replaces the index, dropping the pairs it no longer produces
+    if index is not None and not full:
+        try:
+            entries = load_entries(index)
+        except (TypeError, IndexError, ValueError):
+            print(f"--- malformed dependency index at {filename}, rebuilding it")
+
+    # collect the directories of all toolchains of a pair, a pair is only
+    # indexed if all its compile jobs reported their dependencies
+    run_dirs = {}
+    incomplete = set()
+    for job in results:
+        job = parse_job(job)
+        if job["type"] != "builds":
+            continue
+
+        pair = f"{job['application']} {job['target']}"
+        depdirs = None
+        if job["status"] is not False:
+            depdirs = extract_depdirs(job["output"])
+        if depdirs is None:
+            incomplete.add(pair)
+            continue
+
+        # the application and board directories always affect a build
+        depdirs.add(os.path.normpath(job["application"]))
+        depdirs.add(os.path.join("boards", job["target"]))
+
+        run_dirs.setdefault(pair, set()).update(depdirs)
+
+    for pair in incomplete:
+        run_dirs.pop(pair, None)
+
+    # refreshed pairs are recorded with the commit they were built from, the
+    # others keep the commit of their previous build
+    for pair, depdirs in run_dirs.items():
+        entries[pair] = (commit, depdirs)
+
+    save_index(filename, entries)
+    return len(run_dirs), len(entries)
+
+
+def changed_files(repo_dir, base_commit, commit):
+    output = subprocess.check_output(
+        ["git", "-C", repo_dir, "diff", "--no-renames", "--name-only",
+         base_commit, commit],
+        text=True,
+    )
+    return [line for line in output.split("\n") if line]
+
+
+def affected_pairs(files, dirs):
+    """Return the (ids of the pairs affected by files, first unindexed file).
+
+    If a file is outside all indexed directories, its impact is unknown and
+    the returned ids are None.
+    """
+    affected = set()
+    for filename in files:
+        found = False
+        depdir = os.path.dirname(filename)
+        while depdir:
+            pair_ids = dirs.get(depdir)
+            if pair_ids is not None:
+                affected.update(pair_ids)
+                found = True
+            depdir = os.path.dirname(depdir)
+        if not found:
+            return None, filename
+
+    return affected, None
+
+
+def prune_affected(args, index):
+    """Return the names of the indexed and of the affected pairs.
+
+    The changes of the PR are looked up for all pairs. The changes between the
+    commit a pair was built from and the PR base are looked up for the pairs
+    built from that commit, as they may have changed its dependencies.
+    """
+    pairs, commits, dirs = index
+    names = [name for name, _ in pairs]
+
+    files = changed_files(args.repo_dir, args.base_commit, args.commit)
+    affected, unindexed = affected_pairs(files, dirs)
+    if affected is None:
+        print(f"--- {unindexed} is not in the dependency index", file=sys.stderr)
+        return set(names), None
+
+    built_from = {}
+    for n, (_, commit_id) in enumerate(pairs):
+        built_from.setdefault(commits[commit_id], set()).add(n)
+
+    for commit, pair_ids in built_from.items():
+        try:
+            files = changed_files(args.repo_dir, commit, args.base_commit)
+        except subprocess.CalledProcessError:
+            print(
+                f"--- cannot diff index commit {commit}, not pruning its "
+                f"{len(pair_ids)} pair(s)",
+                file=sys.stderr,
+            )
+            affected.update(pair_ids)
+            continue
+
+        commit_affected, unindexed = affected_pairs(files, dirs)
+        if commit_affected is None:
+            print(
+                f"--- {unindexed} changed since {commit}, not pruning its "
+                f"{len(pair_ids)} pair(s)",
+                file=sys.stderr,
+            )
+            affected.update(pair_ids)
+        else:
+            affected.update(commit_affected & pair_ids)
+
+    return set(names), {names[n] for n in affected}
+
+
+def prune(args):
+    jobs = sys.stdin.read().splitlines(keepends=True)
+
+    affected = None
+    index = load_index(args.index)
+    if index is None:
+        print(f"--- no usable dependency index at {args.index}", file=sys.stderr)
+    else:
+        try:
+            indexed, affected = prune_affected(args, index)
+        except subprocess.CalledProcessError:
+            print("--- cannot list the changed files", file=sys.stderr)
+        except (TypeError, IndexError, ValueError):
+            print(f"--- malformed dependency index at {args.index}", file=sys.stderr)
+
+    if affected is None:
+        print("--- not pruning any job", file=sys.stderr)
+        sys.stdout.writelines(jobs)
+        return
+
+    pruned = []
+    for job in jobs:
+        match = JOB_COMMAND_REGEX.search(job)
+        if match is not None:
+            pair = f"{match.group(2)} {match.group(3)}"
+            # pairs missing from the index have unknown dependencies
+            if pair in indexed and pair not in affected:
+                pruned.append(job)
+                continue
+        sys.stdout.write(job)
+
+    with open(PRUNED_JOBS_FILE, "w") as f:
+        f.writelines(pruned)
+
+    print(
+        f"--- pruned {len(pruned)} of {len(jobs)} job(s) not affected by the "
+        f"changes (see {PRUNED_JOBS_FILE})",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index", type=str, help="Path to the dependency index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_update = subparsers.add_parser(
+        "update", help=f"Update the index from {RESULT_JSON_FILE}"
+    )
+    parser_update.add_argument("commit", type=str, help="Commit that was built")
+    parser_update.add_argument(
+        "--full", action="store_true",
+        help="Results are from a full run, drop the pairs missing from it"
+    )
+    parser_update.set_defaults(func=update)
+
+    parser_prune = subparsers.add_parser(
+        "prune", help="Filter the jobs read from stdin"
+    )
+    parser_prune.add_argument("repo_dir", type=str, help="Path to the RIOT repository")
+    parser_prune.add_argument("base_commit", type=str, help="Commit to diff against")
+    parser_prune.add_argument("commit", type=str, help="Commit that is built")
+    parser_prune.set_defaults(func=prune)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__=="__main__":
+    main()